@@ -30,52 +30,208 @@ The original source is maintained as part of `netutil` package at
 """
 from __future__ import print_function
 
+import os
 import sys
+import signal
 import socket
+import selectors
 import argparse
 
 
 DEFAULT_BIND_HOST = '0.0.0.0'
 DEFAULT_BIND_PORT = 65432
-SOCKET_BUF_SIZE = 1024
-SOCKET_BACKLOG = 5
+SOCKET_BUF_SIZE = 65536  # userspace recv() chunk only; kernel buffers stay autotuned
+NOTSENT_LOWAT = 16384  # bytes of unsent data the kernel may queue per client
+SOCKET_BACKLOG = 128
+
+PROMPT = b"Say something:\n> "
+REPLY_FMT = b"You said: %b\n"
+
+# (level, optname, value) tuples applied to the listener and each accepted socket
+SOCKET_OPTIONS = (
+    (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+)
 
 
 def typeof(obj):
     return type(obj).__name__
 
 
-def start(host, port):
-    """Create server socket and start listening."""
+def set_socket_options(sock, options=SOCKET_OPTIONS):
+    """Apply given `(level, optname, value)` tuples to given socket."""
+    for level, optname, value in options:
+        sock.setsockopt(level, optname, value)
+
+
+def set_notsent_lowat(sock, lowat=NOTSENT_LOWAT):
+    """Bound the unsent data queued in the kernel via TCP_NOTSENT_LOWAT where
+    supported. SO_SNDBUF/SO_RCVBUF are deliberately left alone as setting
+    them disables the kernel buffer autotuning."""
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NOTSENT_LOWAT, lowat)
+    except (AttributeError, OSError):
+        pass  # not available on this platform
+
+
+class Client(object):
+    """Per-connection state: the peer address and the bytes pending to be sent."""
+    def __init__(self, addr):
+        self.addr = addr
+        self.outbuf = b''
+        self.done = False  # no more reading; close once outbuf is flushed
+
+
+def close_client(sel, conn):
+    """Unregister given client socket from the selector and close it."""
+    sel.unregister(conn)
+    conn.close()
+
+
+def accept_clients(sel, sock):
+    """Accept all pending connections on the listening socket, queue the
+    prompt for each and register it with the selector."""
+    while True:
+        try:
+            conn, addr = sock.accept()
+        except BlockingIOError:
+            return  # listen queue drained
+        except OSError as err:
+            print("{}: {}".format(typeof(err), err))
+            return
+        try:
+            set_socket_options(conn)
+            set_notsent_lowat(conn)
+            conn.setblocking(False)
+            print("* Client {0}:{1} connected".format(*addr[0:2]))
+            client = Client(addr)
+            client.outbuf = PROMPT
+            sel.register(conn, selectors.EVENT_READ | selectors.EVENT_WRITE, client)
+        except OSError as err:  # e.g. the peer has already reset; keep serving the others
+            print("{}: {}".format(typeof(err), err))
+            conn.close()  # never leak the fd of a half set up client
+            continue
+
+
+def serve_client(sel, conn, client, mask):
+    """Handle read/write readiness on a client connection."""
+    try:
+        if mask & selectors.EVENT_READ and not client.done:
+            data = conn.recv(SOCKET_BUF_SIZE)
+            if not data:  # peer closed (e.g. a tcpping probe), nobody to reply to
+                close_client(sel, conn)
+                return
+            reply = data.rstrip()
+            if reply:
+                print("Client said:", reply.decode(errors='replace'))
+            client.outbuf += REPLY_FMT % reply
+            client.done = True
+
+        if mask & selectors.EVENT_WRITE and client.outbuf:
+            sent = conn.send(client.outbuf)
+            client.outbuf = client.outbuf[sent:]
+
+    except BlockingIOError:
+        return
+
+    except (BrokenPipeError, ConnectionResetError):  # peer went away, nothing to report
+        close_client(sel, conn)
+        return
+
+    except OSError as err:
+        print("{}: {}".format(typeof(err), err))
+        close_client(sel, conn)
+        return
+
+    if client.done and not client.outbuf:
+        close_client(sel, conn)
+        return
+    events = 0 if client.done else selectors.EVENT_READ
+    if client.outbuf:
+        events |= selectors.EVENT_WRITE
+    sel.modify(conn, events, client)
+
+
+def start(host, port, workers=1):
+    """Create server socket and start serving clients in an event loop.
+    With `workers` greater than one, fork that many processes in total,
+    all of them serving the same listening socket."""
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    set_socket_options(sock)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     try:
         sock.bind((host, port))
 
-    except socket.error as err:
-        print("E: Bind failed: [Errno {0}] {1}".format(*err[0:2]))
+    except OSError as err:
+        print("E: Bind failed: [Errno {}] {}".format(err.errno, err.strerror))
         sys.exit(2)
 
     try:
         sock.listen(SOCKET_BACKLOG)
+        sock.setblocking(False)
         print("Echo Server (TCP) listening on {} port {}...".format(host, port))
+        sys.stdout.flush()  # or each forked child would repeat what's still buffered
+        sys.stderr.flush()
+        child = False
+        pids = []
+        for _ in range(workers - 1):
+            pid = os.fork()
+            if pid == 0:
+                child = True
+                break  # children must not fork further
+            pids.append(pid)
+
+    except Exception as err:
+        print("E: Unexpected: {}: {}".format(typeof(err), err))
+        stop_workers(pids)
+        sys.exit(2)
+
+    if child:
+        try:
+            serve(sock)
+        except KeyboardInterrupt:
+            os._exit(0)  # quietly; the parent reports the cancellation, once
+
+    if pids:  # let SIGTERM unwind the parent, so that it stops the workers, too
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        serve(sock)
+    finally:
+        stop_workers(pids)
+
+
+def stop_workers(pids):
+    """Terminate given worker processes and wait for them to exit."""
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass  # already gone
+    for pid in pids:
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass  # already reaped
+
+
+def serve(sock):
+    """Serve clients of given listening socket in an event loop."""
+    sel = selectors.DefaultSelector()  # created per process, after any fork()
+    try:
+        sel.register(sock, selectors.EVENT_READ, None)
         while True:
-            try:
-                conn, addr = sock.accept()  # blocks waiting for a client to connect
-                print("* Client {0}:{1} connected".format(*addr[0:2]))
-                conn.send("Say something:\n> ")
-                reply = conn.recv(SOCKET_BUF_SIZE).rstrip()
-                if reply:
-                    print("Client said:", reply)
-                conn.send("You said: {}\n".format(reply))
-                conn.close()
-
-            except socket.error as err:
-                print("{}: {}".format(typeof(err), err))
+            for key, mask in sel.select():
+                if key.data is None:
+                    accept_clients(sel, key.fileobj)
+                else:
+                    serve_client(sel, key.fileobj, key.data, mask)
 
     except Exception as err:
         print("E: Unexpected: {}: {}".format(typeof(err), err))
         sys.exit(2)
 
+    finally:
+        sel.close()
+
 
 def parse_args(argv):
     """Parse the command line and return a Namespace containing the result.
@@ -87,6 +243,8 @@ def parse_args(argv):
                         help="host/address to bind to (default: %(default)s)")
     parser.add_argument('-p', '--port', metavar='BIND-PORT', type=int, default=DEFAULT_BIND_PORT,
                         help="TCP port to bind to (default: %(default)s)")
+    parser.add_argument('-w', '--workers', metavar='N', type=int, default=1,
+                        help="number of worker processes sharing the port (default: %(default)s)")
     args = parser.parse_args(argv)
     return args
 
@@ -94,7 +252,7 @@ def parse_args(argv):
 def main(argv):
     args = parse_args(argv)
     try:
-        start(args.bind, args.port)
+        start(args.bind, args.port, args.workers)
     except KeyboardInterrupt:
         print(" Canceled by user")
 
@@ -36,16 +36,22 @@ The original source is maintained as part of `netutil` package at
 TODO:
 - Implement -q, -V options
 - Add support for IPv6 addresses
-- Add support + tests for python3
 
 """
 
 from __future__ import print_function
 
+import os
+import re
 import sys
 import time
+import math
+import errno
 import socket
 import argparse
+import contextlib
+from array import array
+from time import perf_counter_ns
 from timeit import default_timer as wall_time
 
 
@@ -54,11 +60,26 @@ __version__ = '0.1.1'
 DEFAULT_MAX_COUNT = 1000
 DEFAULT_INTERVAL = 1.0
 SOCKET_TIMEOUT = 1.0
+MAX_RETAINED_SAMPLES = 1000000  # beyond that, statistics are computed on the fly
+SPIN_THRESHOLD = 1e-3  # seconds; the last stretch before a deadline is spun, not slept
 DOT = '.'
 
+# errno values connect_ex() reports when a connection attempt times out
+TIMEOUT_ERRNOS = (errno.EAGAIN, errno.EWOULDBLOCK, errno.ETIMEDOUT)
+
+# (level, optname, value) tuples applied to each client socket before connect()
+SOCKET_OPTIONS = (
+    (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+)
+
+IPV4_RE = re.compile(r'([0-9]{1,3})\.([0-9]{1,3})\.([0-9]{1,3})\.([0-9]{1,3})\Z')
+
 HEADER_TMPL = '''TCPPING {} ({}) TCP SYN/ACK/close'''
 
 RTT_TMPL = "rtt min/avg/max/mdev = {:.3f}/{:.3f}/{:.3f}/{:.3f} ms"
+RTT_STDDEV_TMPL = "rtt min/avg/max/stddev = {:.3f}/{:.3f}/{:.3f}/{:.3f} ms"  # RunningStats
+
+MSG_TMPL = "TCP/ACK from %s[%d]: tcp_seq=%d time=%.3f ms\n"
 
 FOOTER_TMPL = '''
 --- {ipaddr} tcpping statistics ---
@@ -70,16 +91,20 @@ def typeof(obj):
     return type(obj).__name__
 
 
-class suppress(object):
-    """Poor mans's contextlib.suppress() for python2."""
-    def __init__(self, *exctypes):
-        self._exctypes = exctypes
-    def __enter__(self):
-        return self
-    def __exit__(self, typ, val, tb):
-        if typ in self._exctypes:
-            return True
-        return None  # explicitly
+suppress = contextlib.suppress
+
+# stateless, hence safe to reuse for every cleanup
+_SUPPRESS_ALL = suppress(Exception)
+
+
+def set_socket_options(sock, options=SOCKET_OPTIONS):
+    """Apply given `(level, optname, value)` tuples to given socket.
+    :param sock: socket - the socket to configure
+    :param options: iterable - `(level, optname, value)` tuples
+    :return: None
+    """
+    for level, optname, value in options:
+        sock.setsockopt(level, optname, value)
 
 
 def mean(numbers):
@@ -91,63 +116,190 @@ def statistics(numbers):
     """Return a four-element tuple with following statistics:
     (min, max, avg, mdev) where mdev is the mean deviation.
 
-    :param numbers: list - a list of floats
+    Uses numpy for a vectorized computation when it is available.
+
+    :param numbers: list - a list (or array) of floats
     :return: tuple
     """
-    if not numbers:
+    if len(numbers) == 0:
         return (0.0, 0.0, 0.0, 0.0)
+    try:
+        import numpy as np  # imported lazily, it takes long to load
+    except ImportError:  # numpy is optional
+        np = None
+    if np is not None:
+        arr = np.asarray(numbers, dtype=np.float64)
+        avg = arr.mean()
+        return float(arr.min()), float(arr.max()), float(avg), float(np.abs(arr - avg).mean())
     avg = mean(numbers)
     mean_deviation = mean([abs(el - avg) for el in numbers])
     return min(numbers), max(numbers), avg, mean_deviation
 
 
+class RunningStats(object):
+    """Streaming (one pass, O(1) memory) counterpart of `statistics()`, using
+    Welford's algorithm for the mean. An exact mean deviation needs all the
+    samples, so `statistics()` here reports the standard deviation instead
+    (which is what iputils `ping` reports as mdev, too)."""
+    def __init__(self):
+        self.count = 0
+        self.min = math.inf
+        self.max = 0.0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, value):
+        self.count += 1
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    def statistics(self):
+        """Return `(min, max, avg, stddev)`, see `statistics()`."""
+        if not self.count:
+            return (0.0, 0.0, 0.0, 0.0)
+        return self.min, self.max, self.mean, math.sqrt(self._m2 / self.count)
+
+
 def is_valid_ipv4(addr):
     """Return `True` iff given string is a valid IPv4 address.
     :param addr: str - the IP address (e.g. '127.0.0.1')
     :return: bool
     """
-    try:
-        socket.inet_aton(addr)
-        return True
-    except socket.error:
-        return False
+    match = IPV4_RE.match(addr)  # no exception raised (and paid for) on host names
+    return bool(match) and all(int(octet) <= 255 for octet in match.groups())
 
 
-def tcp_ping(host, port):
-    """Try opening a TCP connection ('tcp-ping'). Return `True` on success
-    and `False` on failure.
+def sleep_until(deadline):
+    """Sleep until given `time.perf_counter()` deadline, spinning on `sleep(0)`
+    for the last `SPIN_THRESHOLD` seconds for better accuracy.
 
-    :param host: str - the host to try opening connections to
-    :param port: int - the TCP port to try opening connections to
-    :return:
+    :param deadline: float - the moment to return at, in perf_counter seconds
+    :return: None
     """
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    remaining = deadline - time.perf_counter()
+    if remaining > SPIN_THRESHOLD:
+        time.sleep(remaining - SPIN_THRESHOLD)
+    while time.perf_counter() < deadline:
+        time.sleep(0)
+
+
+def new_socket(family=socket.AF_INET, socktype=socket.SOCK_STREAM):
+    """Return a new client socket with `SOCKET_OPTIONS` and `SOCKET_TIMEOUT` applied."""
+    sock = socket.socket(family, socktype)
+    set_socket_options(sock)
     sock.settimeout(SOCKET_TIMEOUT)
-    start = wall_time()  # measure wall time, always
+    return sock
+
+
+def close_socket(sock):
+    """Shut down and close given socket, ignoring any errors."""
+    with _SUPPRESS_ALL:
+        sock.shutdown(socket.SHUT_RDWR)
+    with _SUPPRESS_ALL:
+        sock.close()
+
+
+def connect_error_msg(err):
+    """Return a user-friendly message for given connect() errno value.
+    :param err: int - the errno value
+    :return: str
+    """
+    if err in TIMEOUT_ERRNOS:
+        return "Connection timed out"
+    return "OSError: [Errno {}] {}".format(err, os.strerror(err))
+
+
+def tcp_ping(sockaddr, family=socket.AF_INET, socktype=socket.SOCK_STREAM):
+    """Try opening a TCP connection ('tcp-ping'). Return a two-element tuple
+    `(isok, timespan)` where `isok` is `True` on success and `False` on failure
+    and `timespan` is the connect time in integer nanoseconds (-1 on failure).
+
+    :param sockaddr: tuple - pre-resolved `(ipaddr, port)` socket address
+      to try opening connections to
+    :param family: int - the socket address family
+    :param socktype: int - the socket type
+    :return:
+    """
+    sock = new_socket(family, socktype)
+    start = perf_counter_ns()  # measure wall time, always
 
     try:
-        sock.connect((host, port))
+        err = sock.connect_ex(sockaddr)  # errno instead of an exception on failure
+        timespan = perf_counter_ns() - start
 
-    except socket.timeout:
-        print("Connection timed out (132)")
+    except Exception as exc:  # e.g. a malformed address
+        print("{}: {}".format(typeof(exc), exc))
         return False, -1
 
-    except OSError as err:
-        print("OSError:", str(err), "(136)")
+    else:
+        if err == 0:
+            return True, timespan
+        print(connect_error_msg(err))
         return False, -1
 
-    except Exception as err:
-        print("{}: {} (140)".format(typeof(err), err))
-        return False, -1
+    finally:
+        close_socket(sock)
 
-    else:
-        return True, wall_time() - start
+
+def tcp_ping_batch(sockaddr, size, family=socket.AF_INET, socktype=socket.SOCK_STREAM):
+    """Try opening `size` TCP connections concurrently using non-blocking
+    sockets and a selector. Return a list of `size` two-element tuples
+    `(isok, timespan)`, in the order of the attempts, in the same fashion
+    as `tcp_ping()` does for a single attempt.
+
+    :param sockaddr: tuple - pre-resolved `(ipaddr, port)` socket address
+      to try opening connections to
+    :param size: int - the number of concurrent attempts
+    :param family: int - the socket address family
+    :param socktype: int - the socket type
+    :return: list
+    """
+    import selectors  # only needed with --parallel
+
+    results = [(False, -1)] * size
+    selector = selectors.DefaultSelector()
+    socks = []
+
+    try:
+        for idx in range(size):
+            sock = new_socket(family, socktype)
+            socks.append(sock)
+            sock.setblocking(False)
+            start = perf_counter_ns()  # measure wall time, always
+            err = sock.connect_ex(sockaddr)
+            if err in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                selector.register(sock, selectors.EVENT_WRITE, (idx, start))
+            else:
+                print(connect_error_msg(err))
+
+        deadline = wall_time() + SOCKET_TIMEOUT
+        while selector.get_map():
+            remaining = deadline - wall_time()
+            if remaining <= 0:
+                break
+            events = selector.select(remaining)
+            now = perf_counter_ns()
+            for key, _ in events:  # drain all ready sockets before selecting again
+                selector.unregister(key.fileobj)
+                idx, start = key.data
+                err = key.fileobj.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if err:
+                    print(connect_error_msg(err))
+                else:
+                    results[idx] = (True, now - start)
+
+        for _ in selector.get_map():
+            print("Connection timed out")
+
+        return results
 
     finally:
-        with suppress(socket.error, Exception):
-            sock.shutdown(socket.SHUT_RDWR)
-        with suppress(socket.error, Exception):
-            sock.close()
+        selector.close()
+        for sock in socks:
+            close_socket(sock)
 
 
 def get_hostname_ipaddr(args):
@@ -180,50 +332,88 @@ def do_loop(args, ipaddr):
     """Do the loop of repeating connection attempts gathering outcome data
     and return a three-element tuple `(passed: int, failed:int, times_list: list)`
     where `passed` and `failed` are counts of successful and unsuccessful
-    connection attempts respectively, and `times_list` is a list of floats
-    representing response times in seconds for each successful attempt.
+    connection attempts respectively, and `times_list` is an `array('q')` of
+    response times in integer nanoseconds for each successful attempt.
+
+    For counts above `MAX_RETAINED_SAMPLES`, samples are not retained and
+    `times_list` is a `RunningStats` instance instead (reporting stddev, not mdev).
+
+    With `args.parallel` greater than one, attempts are made in concurrent
+    batches of that size. Batches (or single attempts) are started every
+    `args.interval` seconds, independent of how long each of them took; an
+    attempt taking longer than that makes the loop skip the slots it missed,
+    so attempts are never started less than `args.interval` apart.
 
     :param args: Namespace - parsed command line arguments to the tcpping tool
     :param ipaddr: str - the host ipv4 address
     :return: tuple
     """
-    host, port, count = args.host, args.port, args.count
+    port, count, interval = args.port, args.count, args.interval
+    batch = max(args.parallel, 1)
+    # globals and attributes used per attempt are bound to locals (cheaper lookups)
+    family, socktype = socket.AF_INET, socket.SOCK_STREAM
+    ping, ping_batch, sleep, msg_tmpl = tcp_ping, tcp_ping_batch, sleep_until, MSG_TMPL
+    sockaddr = socket.getaddrinfo(ipaddr, port, family, socktype)[0][4]
     passed = 0
     failed = 0
-    times_list = list()
+    if count <= MAX_RETAINED_SAMPLES:
+        times = array('q', [0]) * count  # pre-allocated, filled up to `stored`
+        running = None
+    else:
+        times = None
+        running = RunningStats()
+    stored = 0
+    write, flush = sys.stdout.write, sys.stdout.flush
+    deadline = time.perf_counter()  # start of the current slot
 
     try:
-        for idx in xrange(count):
+        for first in range(0, count, batch):
+            size = min(batch, count - first)
             try:
-                isok, timespan = tcp_ping(ipaddr, port)
+                if size == 1:
+                    outcomes = [ping(sockaddr, family, socktype)]
+                else:
+                    outcomes = ping_batch(sockaddr, size, family, socktype)
 
             except Exception as err:
                 print("{}: {} (201)".format(typeof(err), err))
-                isok, timespan = False, -1
-
-            passed += int(isok)
-            failed += int(not isok)
-            if isok:
-                if timespan >= 0.0:
-                    times_list.append(timespan)
-                msg = "TCP/ACK from {}[{}]: tcp_seq={} time={:.3f} ms" \
-                      .format(ipaddr, port, idx+1, 1000.0 * timespan)
-                print(msg)
-            if idx + 1 < count:
-                time.sleep(args.interval)
-
-        return (passed, failed, times_list)
+                outcomes = [(False, -1)] * size
+
+            lines = []
+            for idx, (isok, timespan) in enumerate(outcomes, first):
+                passed += int(isok)
+                failed += int(not isok)
+                if isok:
+                    if timespan >= 0:
+                        if running is None:
+                            times[stored] = timespan
+                            stored += 1
+                        else:
+                            running.add(timespan)
+                    lines.append(msg_tmpl % (ipaddr, port, idx+1, timespan / 1e6))
+            if lines:  # a single write (and flush) per batch
+                write(''.join(lines))
+                flush()
+            if first + size < count:  # keep a steady cadence regardless of RTT
+                deadline += interval
+                late = time.perf_counter() - deadline
+                if late > 0:  # skip the slots missed (e.g. on timeouts), don't catch up
+                    deadline += (late // interval + 1) * interval
+                sleep(deadline)
 
     except KeyboardInterrupt:
-        return (passed, failed, times_list)
+        pass
+
+    return (passed, failed, times[:stored] if running is None else running)
 
 
-def header(args):
+def header(hostname, ipaddr):
     """Return the header template with host name and address interpolated.
-    :param args: Namespace - parsed command line arguments to the tcpping tool
+    :param hostname: str - the destination host name
+    :param ipaddr: str - the destination host ipv4 address
     :return: str
     """
-    return HEADER_TMPL.format(*get_hostname_ipaddr(args))
+    return HEADER_TMPL.format(hostname, ipaddr)
 
 
 def footer(*args):
@@ -235,8 +425,12 @@ def footer(*args):
     total = passed + failed
     percent = int(round(100.0 * failed / total)) if total else 0
     totaltime = int(round(totaltime * 1000.0))
-    min, max, avg, mdev = [(elem * 1000.0) for elem in statistics(times_list)]
-    rtt_stats = RTT_TMPL.format(min, max, avg, mdev) if max else ""
+    if isinstance(times_list, RunningStats):
+        stats, rtt_tmpl = times_list.statistics(), RTT_STDDEV_TMPL
+    else:
+        stats, rtt_tmpl = statistics(times_list), RTT_TMPL
+    min, max, avg, mdev = [(elem / 1e6) for elem in stats]
+    rtt_stats = rtt_tmpl.format(min, max, avg, mdev) if max else ""
     return FOOTER_TMPL.format(**locals())
 
 
@@ -249,10 +443,14 @@ def parse_args(argv):
     parser.add_argument('host', metavar='destination', type=str, help="destination host name or IP address")
     parser.add_argument('port', metavar='port', type=int, help="destination tcp port")
     parser.add_argument('-c', metavar='count', dest='count', type=int, default=DEFAULT_MAX_COUNT,
-                        help="Stop after making count SYN/ACK attempts (default: %(default)s)")
+                        help="Stop after making count SYN/ACK attempts (default: %(default)s); "
+                             "above {}, stddev is reported instead of mdev".format(MAX_RETAINED_SAMPLES))
     parser.add_argument('-i', metavar='interval', dest='interval', type=float, default=DEFAULT_INTERVAL,
                         help="Wait interval seconds between attempting connection; "
                              "default is %(default)ss; cannot be less than 0.2s")
+    parser.add_argument('--parallel', metavar='K', dest='parallel', type=int, default=1,
+                        help="Make K concurrent connection attempts per interval "
+                             "(default: %(default)s)")
     parser.add_argument('-n', dest='numeric_only', action='store_true',
                         help="Numeric output only. No attempt will be made "
                              "to lookup symbolic names for host addresses.")
@@ -266,8 +464,8 @@ def parse_args(argv):
 def main(argv):
     """Do the job and return an int result code."""
     args = parse_args(argv)
-    print(header(args))
-    hostname, ipaddr = get_hostname_ipaddr(args)
+    hostname, ipaddr = get_hostname_ipaddr(args)  # resolve once, never again
+    print(header(hostname, ipaddr))
     start_all = wall_time()
     try:
         results = list(do_loop(args, ipaddr))
@@ -6,9 +6,14 @@ TODO:
  - Provide real world end-user functional tests.
 """
 
+import io
+import argparse
 import unittest
+import contextlib
+from unittest import mock
 
-from tcpping import statistics, suppress
+import tcpping
+from tcpping import RunningStats, is_valid_ipv4, statistics, suppress
 
 
 class TestTcpPingParts(unittest.TestCase):
@@ -43,6 +48,34 @@ class TestTcpPingParts(unittest.TestCase):
         for exp, act in zip(expected, statistics(data)):
             self.assertAlmostEqual(exp, act)
 
+    def test_running_stats_case_1(self):
+        data = [3.0, 6.0, 6.0, 7.0, 8.0, 11.0, 15.0, 16.0]
+        expected = [3.0, 16.0, 9.0, 18.5 ** 0.5]  # mdev is the standard deviation here
+        running = RunningStats()
+        for value in data:
+            running.add(value)
+        for exp, act in zip(expected, running.statistics()):
+            self.assertAlmostEqual(exp, act)
+
+    def test_running_stats_case__empty(self):
+        self.assertEqual((0.0, 0.0, 0.0, 0.0), RunningStats().statistics())
+
+    def test_footer_case__running_stats_labelled_stddev(self):
+        running = RunningStats()
+        for value in (1e6, 3e6):
+            running.add(value)
+        text = tcpping.footer(2, 0, running, 0.5, 'localhost', '127.0.0.1')
+        self.assertIn("rtt min/avg/max/stddev = ", text)
+        self.assertIn("rtt min/avg/max/mdev = ", tcpping.footer(2, 0, [1e6, 3e6], 0.5, 'localhost', '127.0.0.1'))
+
+    def test_is_valid_ipv4_case__valid(self):
+        for addr in ('127.0.0.1', '0.0.0.0', '255.255.255.255'):
+            self.assertTrue(is_valid_ipv4(addr), addr)
+
+    def test_is_valid_ipv4_case__invalid(self):
+        for addr in ('localhost', 'example.com', '256.0.0.1', '1.2.3', '1.2.3.4.5', '1.2.3.4\n', ''):
+            self.assertFalse(is_valid_ipv4(addr), addr)
+
     def test_suppress_case__suppress_zero_devision_error(self):
         with suppress(ZeroDivisionError):
             1 / 0
@@ -53,5 +86,48 @@ class TestTcpPingParts(unittest.TestCase):
                 1 / 0
 
 
+class FakeTime(object):
+    """Stands in for the `time` module, with a clock advanced by sleep() only."""
+    def __init__(self):
+        self.now = 0.0
+    def perf_counter(self):
+        return self.now
+    def sleep(self, secs):
+        self.now += max(secs, 1e-5)  # sleep(0) still lets (fake) time pass
+
+
+class TestDoLoop(unittest.TestCase):
+
+    def run_loop(self, durations, interval=0.2):
+        """Run do_loop() with a stubbed tcp_ping() taking given (fake) times
+        and return the moments the attempts were started at."""
+        fake_time = FakeTime()
+        starts = []
+
+        def fake_ping(*args):
+            starts.append(fake_time.now)
+            fake_time.now += durations[len(starts) - 1]
+            return True, 1000
+
+        args = argparse.Namespace(port=7, count=len(durations), interval=interval,
+                                  parallel=1)
+        with mock.patch.object(tcpping, 'time', fake_time), \
+                mock.patch.object(tcpping, 'tcp_ping', fake_ping), \
+                contextlib.redirect_stdout(io.StringIO()):
+            passed, failed, _ = tcpping.do_loop(args, '127.0.0.1')
+        self.assertEqual((len(durations), 0), (passed, failed))
+        return starts
+
+    def test_do_loop_case__steady_cadence(self):
+        starts = self.run_loop([0.05] * 5)
+        for exp, act in zip([0.0, 0.2, 0.4, 0.6, 0.8], starts):
+            self.assertAlmostEqual(exp, act, places=3)
+
+    def test_do_loop_case__no_catching_up_after_slow_attempts(self):
+        starts = self.run_loop([1.0] * 4 + [0.0] * 10)
+        gaps = [b - a for a, b in zip(starts, starts[1:])]
+        self.assertTrue(all(gap >= 0.2 - 1e-3 for gap in gaps), gaps)
+
+
 if __name__ == '__main__':
     unittest.main()